@@ -0,0 +1,129 @@
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# points every client at harness/docker-compose.yml; anything already exported wins
+HARNESS_ENV = {
+    "HTTP_HOST_OVERRIDES": "weather.uwyo.edu=http://127.0.0.1:8001,api.weather.com=http://127.0.0.1:8002",
+    "API_KEY": "harness",
+    "WEATHER_API_KEY": "harness",
+    "DB_HOST": "127.0.0.1",
+    "DB_PORT": "5432",
+    "DB_USER": "harness",
+    "DB_PASS": "harness",
+    "DB_NAME": "weather",
+    "AWS_ACCESS_KEY_ID": "harness",
+    "AWS_SECRET_ACCESS_KEY": "harness-secret",
+    "AWS_BUCKET_NAME": "harness",
+    "AWS_ENDPOINT_URL": "http://127.0.0.1:9000",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    # every main iteration asks for the same urls, cached responses would never reach the stand-ins
+    "HTTP_CACHE": "0",
+}
+for key, value in HARNESS_ENV.items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "training"))
+os.chdir(ROOT)
+
+import boto3
+import features
+import main
+
+
+def ensure_bucket():
+    s3 = boto3.client('s3')
+    bucket = os.getenv("AWS_BUCKET_NAME")
+    existing = [b["Name"] for b in s3.list_buckets().get("Buckets", [])]
+    if bucket not in existing:
+        s3.create_bucket(Bucket=bucket)
+
+
+def run_main(args, i):
+    # the scheduled jobs print and swallow their errors, which would report every run as a success
+    main.run_prediction(raise_errors=True)
+    main.run_verification(raise_errors=True)
+
+
+def run_backfill(args, i):
+    start = args.start + timedelta(days=i*args.days)
+    main.backfill(start, start + timedelta(days=args.days - 1))
+
+
+def run_training(args, i):
+    # a fresh partition dir per run, otherwise later runs only read earlier runs' files
+    partition_dir = tempfile.mkdtemp(prefix="partitions-")
+    try:
+        features.get_training_data(partition_dir)
+    finally:
+        shutil.rmtree(partition_dir, ignore_errors=True)
+
+
+SCENARIOS = {
+    "main": run_main,
+    "backfill": run_backfill,
+    "training": run_training,
+}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p/100*len(ordered)) - 1)]
+
+
+def timed(func, args, i):
+    start = time.perf_counter()
+    try:
+        func(args, i)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if args.verbose:
+            traceback.print_exc()
+    return time.perf_counter() - start, error
+
+
+def report(name, results, wall):
+    latencies = [latency for latency, _ in results]
+    errors = [error for _, error in results if error is not None]
+    print(f"\n{name}: {len(results)} runs in {wall:.1f}s ({len(results)/wall:.2f} runs/s), {len(errors)} errors")
+    for p in (50, 90, 95, 99):
+        print(f"  p{p:<3} {percentile(latencies, p):8.3f}s")
+    print(f"  max  {max(latencies):8.3f}s")
+    for error in sorted(set(errors)):
+        print(f"  {errors.count(error)}x {error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="drive the pipeline against the local stand-ins")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS) + ["all"])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--start", type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+                        default=datetime(2024, 1, 1).date(), help="first backfill date")
+    parser.add_argument("--days", type=int, default=30, help="days per backfill run")
+    parser.add_argument("--months", default="202401-202402", help="training fetch MONTH_RANGE")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    first, last = args.months.split("-")
+    features.MONTH_RANGE = (int(first), int(last))
+    ensure_bucket()
+    names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    for name in names:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda i: timed(SCENARIOS[name], args, i), range(args.iterations)))
+        report(name, results, time.perf_counter() - start)
@@ -0,0 +1,14 @@
+-- hourly station readings shaped like the production public.weather table
+CREATE TABLE IF NOT EXISTS public.weather (
+    api_datetime timestamp NOT NULL,
+    temp_f double precision
+);
+
+INSERT INTO public.weather (api_datetime, temp_f)
+SELECT ts,
+       round((55 + 22*sin(2*pi()*(extract(doy from ts) - 105)/365)
+              - 8*cos(2*pi()*(extract(hour from ts) - 19)/24)
+              + (random() - 0.5)*6)::numeric, 1)
+FROM generate_series('2019-12-01'::timestamp, '2027-01-01'::timestamp, interval '1 hour') AS ts;
+
+CREATE INDEX IF NOT EXISTS weather_api_datetime_idx ON public.weather (api_datetime);
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import urllib.request
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+STATION_NAMES = {
+    "72305": "MHX", "72317": "GSO", "72318": "RNK", "72520": "PIT", "72528": "BUF",
+    "72426": "ILN", "72501": "OKX", "72403": "IAD", "72402": "WAL",
+}
+# query params that differ per caller but not per response
+IGNORED_PARAMS = ("apiKey",)
+
+
+def recording_key(path):
+    parts = urlsplit(path)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in IGNORED_PARAMS)
+    return hashlib.sha1(f"{parts.path}?{query}".encode()).hexdigest()
+
+
+def recording_path(site, path):
+    return os.path.join(RECORDINGS_DIR, site, recording_key(path) + ".json")
+
+
+def load_recording(site, path):
+    file_path = recording_path(site, path)
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as file:
+        return json.load(file)
+
+
+def save_recording(site, path, status, content_type, body):
+    file_path = recording_path(site, path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump({"path": path, "status": status, "content_type": content_type, "body": body}, file)
+
+
+def seasonal_temp(day, seed):
+    rng = random.Random(seed)
+    return 55 + 22*math.sin(2*math.pi*(day.timetuple().tm_yday - 105)/365) + rng.uniform(-6, 6)
+
+
+def sounding_table(station, day):
+    rng = random.Random(f"{station}{day}")
+    surface_c = (seasonal_temp(day, station) - 32)*5/9
+    lines = ["-"*77, "   PRES   HGHT   TEMP   DWPT   RELH   MIXR   DRCT   SKNT   THTA   THTE   THTV",
+             "    hPa     m      C      C      %    g/kg    deg   knot     K      K      K", "-"*77, ""]
+    for i, pressure in enumerate(range(1010, 95, -15)):
+        height = int(44330*(1 - (pressure/1013.25)**0.1903))
+        # the scraper's regex drops signs, so keep every value positive like the surface rows
+        temp = abs(surface_c - 6.5*height/1000)
+        dew_point = temp + rng.uniform(0, 8)
+        vals = [pressure, height, temp, dew_point, rng.randint(5, 100), rng.uniform(0.01, 15),
+                rng.randint(0, 359), rng.randint(0, 120), 280 + i, 300 + i, 281 + i]
+        lines.append(" ".join(f"{v:7.1f}" if isinstance(v, float) else f"{v:7d}" for v in vals))
+    return "\n".join(lines)
+
+
+def synthetic_uwyo(query):
+    year, month = int(query["YEAR"]), int(query["MONTH"])
+    first, last = int(query["FROM"][:2]), int(query["TO"][:2])
+    hour = query["FROM"][2:]
+    station = query["STNM"]
+    name = STATION_NAMES.get(station, station)
+    body = ["<html><body>"]
+    for day in range(first, last + 1):
+        dt = date(year, month, day)
+        body.append(f"<h2>{station} {name} Observations at {hour}Z {dt.strftime('%d %b %Y')}</h2>")
+        body.append(f"<pre>\n{sounding_table(station, dt)}\n</pre>")
+    body.append("</body></html>")
+    return "text/html", "\n".join(body)
+
+
+def synthetic_weather(path, query):
+    day = datetime.strptime(query["date"], "%Y%m%d").date()
+    high_f = seasonal_temp(day, query.get("stationId", ""))
+    if path.endswith("/daily"):
+        obs = [{"obsTimeUtc": f"{day}T23:59:59Z", "humidityAvg": 60,
+                "metric": {"tempHigh": round((high_f - 32)*5/9), "dewptHigh": 10,
+                           "pressureMax": 1015.0, "pressureTrend": 0.0}}]
+    else:
+        obs = []
+        for hour in range(24):
+            temp_c = (high_f - 32)*5/9 - 6*math.cos(2*math.pi*(hour - 20)/24) - 6
+            obs.append({"obsTimeUtc": f"{day}T{hour:02d}:00:00Z", "humidityAvg": 55 + hour % 20,
+                        "metric": {"tempHigh": round(temp_c), "dewptHigh": round(temp_c) - 4,
+                                   "windspeedAvg": 3, "pressureMax": 1013.0 + hour/10,
+                                   "pressureTrend": 0.1}})
+    return "application/json", json.dumps({"observations": obs})
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            if config.verbose:
+                super().log_message(format, *args)
+
+        def send(self, status, content_type, body, headers=None):
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(max(0, random.gauss(config.latency, config.jitter))/1000)
+            roll = random.random()
+            if roll < config.throttle_rate:
+                return self.send(429, "text/plain", "rate limited", {"Retry-After": str(config.retry_after)})
+            if roll < config.throttle_rate + config.error_rate:
+                return self.send(503, "text/plain", "unavailable")
+
+            if config.record:
+                with urllib.request.urlopen(config.record + self.path, timeout=60) as resp:
+                    content_type = resp.headers.get("Content-Type", "text/plain")
+                    body = resp.read().decode("utf-8", "replace")
+                    save_recording(config.site, self.path, resp.status, content_type, body)
+                    return self.send(resp.status, content_type, body)
+
+            recording = load_recording(config.site, self.path)
+            if recording is not None:
+                return self.send(recording["status"], recording["content_type"], recording["body"])
+            query = dict(parse_qsl(urlsplit(self.path).query))
+            try:
+                if config.site == "uwyo":
+                    content_type, body = synthetic_uwyo(query)
+                else:
+                    content_type, body = synthetic_weather(urlsplit(self.path).path, query)
+            except (KeyError, ValueError) as e:
+                return self.send(400, "text/plain", f"bad request: {e}")
+            self.send(200, content_type, body)
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="stand-in for the UWyo / weather.com endpoints")
+    parser.add_argument("site", choices=["uwyo", "weather"])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=200, help="mean response latency in ms")
+    parser.add_argument("--jitter", type=float, default=100, help="latency std dev in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--record", metavar="UPSTREAM",
+                        help="proxy to UPSTREAM (e.g. https://weather.uwyo.edu) and save responses")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def serve(config):
+    server = ThreadingHTTPServer((config.host, config.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"{config.site} stand-in listening on {config.host}:{config.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve(parse_args())
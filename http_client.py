@@ -0,0 +1,224 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# 400/403 and friends will never succeed on retry, so only these are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POLICIES = {
+    "weather.uwyo.edu": {"attempts": 6, "budget": 90, "timeout": 30, "backoff": 1.0, "max_backoff": 20,
+                         "concurrency": 4},
+    "api.weather.com": {"attempts": 4, "budget": 30, "timeout": 10, "backoff": 0.5, "max_backoff": 8,
+                        "concurrency": 4},
+}
+DEFAULT_POLICY = {"attempts": 3, "budget": 30, "timeout": 10, "backoff": 0.5, "max_backoff": 8,
+                  "concurrency": 8}
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 300
+POOL_SIZE = 16
+CACHE_TTL = 18*3600
+CACHE_SIZE = 256
+# HTTP_CACHE=0 sends every get_cached call to the network, e.g. so a load test isn't served from memory
+CACHE_ENABLED = os.getenv("HTTP_CACHE", "1") != "0"
+# e.g. "weather.uwyo.edu=http://127.0.0.1:8001,api.weather.com=http://127.0.0.1:8002"
+HOST_OVERRIDES = dict(
+    item.split("=", 1) for item in os.getenv("HTTP_HOST_OVERRIDES", "").split(",") if "=" in item
+)
+
+_session = None
+_lock = threading.Lock()
+_breakers = {}
+_semaphores = {}
+_cache = {}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_after:
+                return False
+            # half open: exactly one caller probes, everyone else stays rejected until it reports back
+            self.probing = True
+            return True
+
+    def release_probe(self):
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def get_breaker(host):
+    with _lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+def get_semaphore(host, policy):
+    with _lock:
+        if host not in _semaphores:
+            _semaphores[host] = threading.BoundedSemaphore(policy["concurrency"])
+        return _semaphores[host]
+
+
+def resolve_url(url):
+    parts = urlsplit(url)
+    if parts.hostname not in HOST_OVERRIDES:
+        return url
+    target = urlsplit(HOST_OVERRIDES[parts.hostname])
+    return urlunsplit((target.scheme, target.netloc, parts.path, parts.query, parts.fragment))
+
+
+def get_retry_after(resp):
+    value = resp.headers.get("Retry-After", "")
+    if value.isdigit():
+        return float(value)
+    return None
+
+
+def get_backoff(policy, attempt, resp=None):
+    retry_after = get_retry_after(resp) if resp is not None else None
+    if retry_after is not None:
+        return retry_after
+    # full jitter keeps parallel callers from retrying in lockstep
+    return random.uniform(0, min(policy["max_backoff"], policy["backoff"]*2**attempt))
+
+
+def get(url, budget=None, **kwargs):
+    host = urlsplit(url).hostname
+    policy = POLICIES.get(host, DEFAULT_POLICY)
+    deadline = time.monotonic() + (budget or policy["budget"])
+    breaker = get_breaker(host)
+    semaphore = get_semaphore(host, policy)
+    session = get_session()
+    url = resolve_url(url)
+    resp = None
+    error = None
+    for attempt in range(policy["attempts"]):
+        # check the budget first so a caller granted the half-open probe always reports back
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {host}")
+        try:
+            # the slot is only held while a request is on the wire, not while backing off
+            with semaphore:
+                resp = session.get(url, timeout=min(policy["timeout"], remaining), **kwargs)
+            error = None
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            breaker.record_failure()
+            resp = None
+            error = e
+        except Exception:
+            breaker.release_probe()
+            raise
+        else:
+            if resp.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return resp
+            if resp.status_code != 429:
+                breaker.record_failure()
+            else:
+                # a rate-limited probe proves nothing either way, free the slot for the next one
+                breaker.release_probe()
+        if attempt == policy["attempts"] - 1:
+            break
+        delay = get_backoff(policy, attempt, resp)
+        if time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+    if resp is not None:
+        return resp
+    if error is not None:
+        raise error
+    raise requests.exceptions.Timeout(f"time budget exhausted for {host}")
+
+
+def get_cached(url, ttl=CACHE_TTL, valid=None, **kwargs):
+    # concurrent callers for the same url share one in-flight request and its response;
+    # valid(resp) decides whether a 200 is worth keeping, e.g. not a page that isn't posted yet
+    if not CACHE_ENABLED:
+        return get(url, **kwargs)
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(url)
+        owner = entry is None or entry[0] <= now
+        if owner:
+            future = Future()
+            _cache.pop(url, None)
+            _cache[url] = (now + ttl, future)
+            while len(_cache) > CACHE_SIZE:
+                _cache.pop(next(iter(_cache)))
+        else:
+            future = entry[1]
+    if not owner:
+        return future.result()
+    try:
+        resp = get(url, **kwargs)
+    except Exception as e:
+        evict(url, future)
+        future.set_exception(e)
+        raise
+    if resp.status_code != 200 or (valid is not None and not is_valid(valid, resp)):
+        evict(url, future)
+    future.set_result(resp)
+    return resp
+
+
+def is_valid(valid, resp):
+    try:
+        return bool(valid(resp))
+    except Exception:
+        return False
+
+
+def evict(url, future):
+    with _lock:
+        entry = _cache.get(url)
+        if entry is not None and entry[1] is future:
+            del _cache[url]
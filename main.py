@@ -1,18 +1,26 @@
 from datetime import datetime, timedelta
+import json
 import pickle
 import pytz
 import psycopg2 as pg2
 import os
 import re
-import requests
 import sys
-from requests.adapters import HTTPAdapter, Retry
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor as JobExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
 import boto3
 from bs4 import BeautifulSoup
+import numpy as np
 import pandas as pd
 
+import http_client
+import memprofile
+import verification
+
 
 STATIONS = {
     "72305": {"city": "Newport, NC", "station_name": "MHX"},
@@ -27,22 +35,40 @@ STATIONS = {
 }
 FIELDS = ["pressure","height","temp","dew_point","rel_humidity",
               "mix_ratio","direction", "knots","theta","theta_e","theta_v"]
+PRESSURE_LEVELS = [1000, 850, 700, 500, 300, 200]
 SOUNDING_HR = "12"
 URL_BASE="https://weather.uwyo.edu/cgi-bin/sounding"
+FETCH_PLAN_FILE = "fetch_plan.json"
+ARTIFACTS_DIR = "./artificats"
 MODEL = "randomforest"
+# trained on 00Z soundings to forecast the next day; the 00Z job stays off until this artifact exists
+MODEL_00Z = "randomforest_00z"
+SCALER_00Z = "scaler_00z.sav"
 FACTOR = 1
 PCA = False
+ENSEMBLE = False
+ENSEMBLE_WEIGHTS = {"randomforest": 0.5, "xgboost": 0.5}
+XGB_NTHREAD = os.cpu_count()
+INTERVAL = False
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+INTERVAL_BATCH_SIZE = 5000
+SCHEDULE_00Z = False
+JOB_WORKERS = 4
+MISFIRE_GRACE_TIME = 3600
+TRAINING_DIR = "./training"
 
 
-def get_session():
-    session = requests.Session()
-    retries = Retry(
-            total=10,
-            backoff_factor=0.1,
-            status_forcelist=[400, 403, 429, 500, 502, 503, 504],
-        )
-    session.mount(URL_BASE, HTTPAdapter(max_retries=retries))
-    return session
+def load_fetch_plan(artifact_dir=None):
+    # the plan ships inside the release it was selected for, so it always matches that release's scaler
+    path = os.path.join(artifact_dir or get_artifact_dir(), FETCH_PLAN_FILE)
+    if not os.path.exists(path):
+        return STATIONS, PRESSURE_LEVELS, FIELDS
+    with open(path) as file:
+        plan = json.load(file)
+    stations = {k: v for k, v in STATIONS.items() if k in plan["stations"]}
+    levels = [p for p in PRESSURE_LEVELS if p in plan["levels"]]
+    fields = [f for f in FIELDS if f in plan["fields"]]
+    return stations, levels, fields
 
 
 def get_dataframe(data):
@@ -57,17 +83,16 @@ def get_dataframe(data):
             values[field].append(val)
     return pd.DataFrame(values)
 
-def consolidate_pressure_levels(df, station, date, sounding_hr):
-    pressure_levels = [1000, 850, 700, 500, 300, 200]
+def consolidate_pressure_levels(df, station, date, sounding_hr, levels=PRESSURE_LEVELS, fields=FIELDS):
     df['pressure'] = df['pressure'].astype(float)
     indexes = []
-    for p in pressure_levels:
+    for p in levels:
         idx = df.iloc[(df['pressure']-p).abs().argsort()].index.values[0]
         indexes.append(idx)
     vals = {}
-    for p, idx in zip(pressure_levels, indexes):
+    for p, idx in zip(levels, indexes):
         row = df.iloc[idx,:]
-        for field in FIELDS:
+        for field in fields:
             val = row[field]
             col = f"{field}_{p}"
             vals[col] = [float(val)]
@@ -77,22 +102,27 @@ def consolidate_pressure_levels(df, station, date, sounding_hr):
     df["station_name"] = STATIONS[station]["station_name"]
     return df
 
-def get_station_data(date, station):
+def has_sounding(resp):
+    # uwyo answers 200 with no <pre> table until the sounding is posted
+    return len(BeautifulSoup(resp.text).findAll(name='pre')) > 0
+
+def has_observations(resp):
+    return len(resp.json().get('observations') or []) > 0
+
+def get_station_data(date, station, sounding_hr=SOUNDING_HR, levels=PRESSURE_LEVELS, fields=FIELDS):
     params={
     "region":"nacon",
     "TYPE":r"TEXT%3ALIST",
     "YEAR":date.year,
     "MONTH":date.month,
-    "FROM":str(date.day).zfill(2)+SOUNDING_HR,
-    "TO": str(date.day).zfill(2)+SOUNDING_HR,
+    "FROM":str(date.day).zfill(2)+sounding_hr,
+    "TO": str(date.day).zfill(2)+sounding_hr,
     "STNM": station
     }
     url_params="?region={region}&TYPE={TYPE}&YEAR={YEAR}&MONTH={MONTH}&FROM={FROM}&TO={TO}&STNM={STNM}"
     params = url_params.format(**params)
     url = URL_BASE + params
-    session = get_session()
-    resp=session.get(url, verify=False)
-    session.close()
+    resp = http_client.get_cached(url, verify=False, valid=has_sounding)
     soup = BeautifulSoup(resp.text)
     tables = soup.findAll(name='pre')
     if len(tables)==0:
@@ -102,14 +132,14 @@ def get_station_data(date, station):
         tmp_df = get_dataframe(table.text.split("\n"))
         if tmp_df.shape[0]>0:
             df = tmp_df
-    final_df = consolidate_pressure_levels(df, station, date, f"{SOUNDING_HR}Z")
+    final_df = consolidate_pressure_levels(df, station, date, f"{sounding_hr}Z", levels, fields)
     final_df = final_df.drop(columns=["sounding_hr"])
     return final_df
 
-def consolidate_stations(df):
+def consolidate_stations(df, stations=STATIONS):
     ignore = ('forecast_date', 'station_name')
     vals = {}
-    for station in STATIONS.keys():
+    for station in stations.keys():
         station_name = STATIONS[station]['station_name']
         for col in df.columns:
             if col not in ignore:
@@ -118,7 +148,7 @@ def consolidate_stations(df):
     vals['forecast_date'] = []
     for date in df["forecast_date"].unique():
         vals['forecast_date'].append(date)
-        for station in STATIONS.keys():
+        for station in stations.keys():
             station_name = STATIONS[station]['station_name']
             tmp_df = df[(df["station_name"]==station_name) & (df["forecast_date"]==date)]
             for col in df.columns:
@@ -132,40 +162,42 @@ def consolidate_stations(df):
     df_updated = pd.DataFrame(vals)
     return df_updated
 
-def get_raw_data(date):
+def get_raw_data(date, sounding_hr=SOUNDING_HR, plan=None):
+    stations, levels, fields = plan or load_fetch_plan()
     df = None
-    for station in STATIONS:
-        tmp_df = get_station_data(date, station)
+    for station in stations:
+        tmp_df = get_station_data(date, station, sounding_hr, levels, fields)
         if tmp_df is None:
             return None
         if df is None:
             df = tmp_df
         else:
             df = pd.concat([df, tmp_df])
-    df = consolidate_stations(df)
+    df = consolidate_stations(df, stations)
     return df
 
-def get_observations(date, station="14"):
+def get_observations(date, station="14", hour=12):
+    # the observation nearest {date} {hour}Z UTC, read from the local-day history that contains it
+    # (00Z on D+1 is the evening of local day D)
+    target = datetime(date.year, date.month, date.day, hour, 0, 0)
+    history_date = pytz.utc.localize(target).astimezone(pytz.timezone('US/Eastern')).date()
     station = f"KNJATCO{station}"
     url = "https://api.weather.com/v2/pws/history/hourly?stationId={station}&format=json&units=m&date={date}&apiKey={key}"
     vals = {'forecast_date': [], 'temp_f_12z': [], 'dew_point_f_12z':[],
             'humidity_12z':[], 'pressure_12z':[], 'pressure_trend_12z':[]
            }
-    dt = date.strftime("%Y%m%d")
+    dt = history_date.strftime("%Y%m%d")
     api_key = os.getenv("API_KEY")
     url_date = url.format(station=station, date=dt, key=api_key)
-    session = get_session()
     try:
-        resp = session.get(url_date, verify=False)
+        resp = http_client.get_cached(url_date, verify=False, valid=has_observations)
         obs = resp.json()['observations']
-        session.close()
     except Exception as e:
-        session.close()
         return None
     if len(obs)==0 or obs is None:
         return None
     
-    dt_12 = datetime(date.year, date.month, date.day, 12,0,0)
+    dt_12 = target
     min_sec = None
     min_index = None
     for i, o in enumerate(obs):
@@ -196,32 +228,55 @@ def get_observations(date, station="14"):
     dfx['forecast_date'] = pd.to_datetime(dfx['forecast_date']).dt.date
     return dfx
 
-def prep_prediction_data(date):
-    with open('./artificats/scaler.sav', 'rb') as file:
+def get_feature_data(date, sounding_hr=SOUNDING_HR, plan=None):
+    df_date = get_raw_data(date, sounding_hr, plan)
+    if df_date is None:
+        raise ValueError(f"no {sounding_hr}Z soundings for {date} yet")
+    df_obs = get_observations(date, hour=int(sounding_hr))
+    if df_obs is None:
+        raise ValueError(f"no surface observations near {date} {sounding_hr}Z")
+    return df_date.merge(df_obs, on='forecast_date', how='inner')
+
+def get_artifact_dir():
+    # artificats/CURRENT names the live release written by training.py; callers resolve it once
+    # per run so a promotion mid-run can't pair one release's scaler with another's model
+    pointer = os.path.join(ARTIFACTS_DIR, "CURRENT")
+    if not os.path.exists(pointer):
+        return ARTIFACTS_DIR
+    with open(pointer) as file:
+        return os.path.join(ARTIFACTS_DIR, "releases", file.read().strip())
+
+def load_pca(artifact_dir=None):
+    with open(os.path.join(artifact_dir or get_artifact_dir(), 'pca.sav'), 'rb') as file:
+        return pickle.load(file)
+
+def prep_prediction_data(date, sounding_hr=SOUNDING_HR, pca=PCA, artifact_dir=None, scaler_name="scaler.sav"):
+    artifact_dir = artifact_dir or get_artifact_dir()
+    with open(os.path.join(artifact_dir, scaler_name), 'rb') as file:
         scaler = pickle.load(file)
-    df_date = get_raw_data(date)
-    df_obs = get_observations(date)
-    df = df_date.merge(df_obs, on='forecast_date', how='inner')
+    df = get_feature_data(date, sounding_hr, load_fetch_plan(artifact_dir))
     df["month"] = pd.to_datetime(df['forecast_date']).dt.month
     df = df.drop(columns=['forecast_date'])
+    if hasattr(scaler, "feature_names_in_"):
+        # put the columns in the order the release was trained on, and fail on any it doesn't have
+        missing = [c for c in scaler.feature_names_in_ if c not in df.columns]
+        if len(missing) > 0:
+            raise ValueError(f"{scaler_name} expects {len(missing)} columns the fetched data lacks: {missing[:10]}")
+        df = df[list(scaler.feature_names_in_)]
     X = scaler.transform(df)
-    if PCA is True:
-        with open('./artificats/pca.sav', 'rb') as file:
-            pca = pickle.load(file)
-        X = pca.transform(X)
+    if pca is True:
+        X = load_pca(artifact_dir).transform(X)
     return X 
 
 def save_to_s3(date, prediction, filename):
-    # save value as text file on s3 using boto3
-    with open(filename, 'w') as file:
-        file.write(str(prediction))
+    # save value as text file on s3 using boto3; uploaded from memory so concurrent jobs
+    # never share a local file, and a client per call since boto3's default session isn't thread safe
     aws_key = os.getenv("AWS_ACCESS_KEY_ID")
     aws_secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-    s3 = boto3.client('s3', aws_access_key_id=aws_key, aws_secret_access_key=aws_secret_key)
+    s3 = boto3.session.Session().client('s3', aws_access_key_id=aws_key, aws_secret_access_key=aws_secret_key)
     bucket = os.getenv("AWS_BUCKET_NAME")
     key = f"{date.year}/{date.month}/{date.day}/{filename}"
-    s3.upload_file(filename, bucket, key)
-    os.remove(filename)
+    s3.put_object(Bucket=bucket, Key=key, Body=str(prediction).encode())
 
 
 def get_prev_day_max_tempf(date):
@@ -246,30 +301,278 @@ def get_prev_day_max_tempf(date):
     df = df[df['date'].dt.date == date]
     return df.temp_f.max()
 
-def predict(data):
-    with open(f'./artificats/{MODEL}.pkl', 'rb') as file:
-        model = pickle.load(file)
+def predict(data, artifact_dir=None, name=MODEL):
+    model = load_model(name, artifact_dir)
     return model.predict(data)[0]*FACTOR
 
-def main():
+def load_model(name, artifact_dir=None):
+    with open(os.path.join(artifact_dir or get_artifact_dir(), f'{name}.pkl'), 'rb') as file:
+        return pickle.load(file)
+
+def predict_model(name, model, data):
+    start = time.perf_counter()
+    if name == "xgboost":
+        # native in-place predict skips the DMatrix copy and runs on its own thread pool
+        booster = model.get_booster() if hasattr(model, "get_booster") else model
+        booster.set_param({"nthread": XGB_NTHREAD})
+        pred = booster.inplace_predict(data)
+    else:
+        pred = model.predict(data)
+    return pred, time.perf_counter() - start
+
+def get_n_features(model):
+    if hasattr(model, "n_features_in_"):
+        return model.n_features_in_
+    return model.num_features()
+
+def get_model_input(name, model, data, pca):
+    # the shipped models disagree on inputs: the forest takes the scaled columns, xgboost the pca output
+    n_features = get_n_features(model)
+    if n_features == data.shape[1]:
+        return data
+    if n_features == pca.n_components_:
+        return pca.transform(data)
+    raise ValueError(f"{name} expects {n_features} features but the scaled input has {data.shape[1]} "
+                     f"and the pca output has {pca.n_components_}")
+
+def check_ensemble(weights=None, artifact_dir=None):
+    weights = weights or ENSEMBLE_WEIGHTS
+    artifact_dir = artifact_dir or get_artifact_dir()
+    pca = load_pca(artifact_dir)
+    for name in weights:
+        get_model_input(name, load_model(name, artifact_dir), np.zeros((1, pca.n_features_in_)), pca)
+
+def predict_ensemble(data, weights=None, artifact_dir=None):
+    # data is the scaled matrix from prep_prediction_data(..., pca=False)
+    weights = weights or ENSEMBLE_WEIGHTS
+    artifact_dir = artifact_dir or get_artifact_dir()
+    models = {name: load_model(name, artifact_dir) for name in weights}
+    pca = load_pca(artifact_dir)
+    inputs = {name: get_model_input(name, model, data, pca) for name, model in models.items()}
+    with ThreadPoolExecutor(max_workers=len(models)) as executor:
+        futures = {name: executor.submit(predict_model, name, model, inputs[name])
+                   for name, model in models.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    total = sum(weights.values())
+    prediction = 0
+    for name, (pred, latency) in results.items():
+        print(f"{name}: {pred[0]*FACTOR} ({latency*1000:.1f} ms)")
+        prediction += pred[0]*weights[name]/total
+    return prediction*FACTOR
+
+def get_leaf_values(model):
+    # pad every tree's node values into one (n_trees, max_nodes) table
+    trees = [est.tree_ for est in model.estimators_]
+    max_nodes = max(tree.node_count for tree in trees)
+    values = np.zeros((len(trees), max_nodes))
+    for i, tree in enumerate(trees):
+        values[i, :tree.node_count] = tree.value[:, 0, 0]
+    return values
+
+def get_tree_predictions(model, data, leaf_values=None):
+    if leaf_values is None:
+        leaf_values = get_leaf_values(model)
+    # one traversal of the whole forest gives the leaf reached in every tree
+    leaves = model.apply(data)
+    return leaf_values[np.arange(leaves.shape[1]), leaves]*FACTOR
+
+def summarize_tree_predictions(preds, quantiles=None):
+    quantiles = quantiles or QUANTILES
+    qs = np.quantile(preds, quantiles, axis=1)
+    summary = {
+        "mean": preds.mean(axis=1),
+        "std": preds.std(axis=1),
+        "spread": preds.max(axis=1) - preds.min(axis=1),
+    }
+    for q, vals in zip(quantiles, qs):
+        summary[f"q{int(round(q*100)):02d}"] = vals
+    return summary
+
+def predict_interval(data, batch_size=INTERVAL_BATCH_SIZE, artifact_dir=None):
+    model = load_model("randomforest", artifact_dir)
+    leaf_values = get_leaf_values(model)
+    summaries = []
+    for start in range(0, data.shape[0], batch_size):
+        preds = get_tree_predictions(model, data[start:start+batch_size], leaf_values)
+        summaries.append(summarize_tree_predictions(preds))
+    return {k: np.concatenate([s[k] for s in summaries]) for k in summaries[0]}
+
+def interval_row(summary, i):
+    return {k: round(float(v[i]), 2) for k, v in summary.items()}
+
+def get_model_version(models=None, artifact_dir=None, scaler_name="scaler.sav"):
+    if models is None:
+        models = list(ENSEMBLE_WEIGHTS) if ENSEMBLE is True else [MODEL]
+    artifact_dir = artifact_dir or get_artifact_dir()
+    # e.g. randomforest@20261019T110000, so rows can be traced back to the release that made them
+    if artifact_dir != ARTIFACTS_DIR:
+        release = os.path.basename(artifact_dir)
+    else:
+        paths = [os.path.join(artifact_dir, f'{name}.pkl') for name in models] + [os.path.join(artifact_dir, scaler_name)]
+        release = verification.get_model_version(paths)
+    return "+".join(models) + "@" + release
+
+def backfill(start, end):
+    artifact_dir = get_artifact_dir()
+    dates = []
+    rows = []
+    date = start
+    while date <= end:
+        try:
+            rows.append(prep_prediction_data(date, pca=False, artifact_dir=artifact_dir))
+            dates.append(date)
+        except Exception as e:
+            print(date, e)
+        date += timedelta(days=1)
+    if len(rows)==0:
+        return
+    summary = predict_interval(np.vstack(rows), artifact_dir=artifact_dir)
+    # kept apart from the live objects and rows so re-scoring never rewrites what was actually forecast
+    version = "backfill-" + get_model_version(["randomforest"], artifact_dir)
+    records = []
+    for i, date in enumerate(dates):
+        interval = interval_row(summary, i)
+        save_to_s3(date, summary["mean"][i], "prediction_backfill.txt")
+        save_to_s3(date, json.dumps(interval), "prediction_interval_backfill.json")
+        records.append((date, verification.SITE, version, float(summary["mean"][i]),
+                        interval.get("q05"), interval.get("q95")))
+    verification.record_predictions(records)
+
+def get_local_date():
     utc_date = datetime.utcnow().replace(tzinfo=pytz.utc)
-    date = utc_date.astimezone(pytz.timezone('US/Eastern')).date()
-    prev_day = date + timedelta(days=-1)
+    return utc_date.astimezone(pytz.timezone('US/Eastern')).date()
+
+def run_prediction_00z(raise_errors=False):
+    # the 23:00 local run reads the 00Z sounding of the next UTC day and forecasts that day (D+1)
+    date = get_local_date() + timedelta(days=1)
+    artifact_dir = get_artifact_dir()
+    try:
+        X = prep_prediction_data(date, "00", pca=False, artifact_dir=artifact_dir, scaler_name=SCALER_00Z)
+        prediction = predict(X, artifact_dir, MODEL_00Z)
+        save_to_s3(date, prediction, "prediction_00z.txt")
+        verification.record_predictions([(date, verification.SITE,
+                                          get_model_version([MODEL_00Z], artifact_dir, SCALER_00Z),
+                                          float(prediction), None, None)])
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(e)
+
+def has_00z_model(artifact_dir=None):
+    artifact_dir = artifact_dir or get_artifact_dir()
+    return all(os.path.exists(os.path.join(artifact_dir, filename)) for filename in (f"{MODEL_00Z}.pkl", SCALER_00Z))
+
+def run_prediction(raise_errors=False):
+    date = get_local_date()
+    artifact_dir = get_artifact_dir()
     try:
-        X = prep_prediction_data(date)
-        prediction = predict(X)
+        if ENSEMBLE is True:
+            X = prep_prediction_data(date, pca=False, artifact_dir=artifact_dir)
+            prediction = predict_ensemble(X, artifact_dir=artifact_dir)
+        else:
+            X = prep_prediction_data(date, artifact_dir=artifact_dir)
+            prediction = predict(X, artifact_dir)
         save_to_s3(date, prediction, "prediction.txt")
-    except Exception:
-        pass
+        interval = {}
+        # the interval comes from the forest's trees, so it only describes a forest prediction
+        if INTERVAL is True and ENSEMBLE is not True and MODEL == "randomforest":
+            interval = interval_row(predict_interval(X, artifact_dir=artifact_dir), 0)
+            save_to_s3(date, json.dumps(interval), "prediction_interval.json")
+        verification.record_predictions([(date, verification.SITE, get_model_version(artifact_dir=artifact_dir),
+                                          float(prediction), interval.get("q05"), interval.get("q95"))])
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(e)
+
+def run_verification(raise_errors=False):
+    prev_day = get_local_date() + timedelta(days=-1)
     prev_day_tempf = get_prev_day_max_tempf(prev_day)
     save_to_s3(prev_day, prev_day_tempf, "max_temp.txt")
+    try:
+        verification.record_observed([(prev_day, verification.SITE, float(prev_day_tempf))])
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(e)
+
+def get_label(date, station="14"):
+    url = "https://api.weather.com/v2/pws/history/daily?stationId={station}&format=json&units=m&date={date}&apiKey={key}"
+    url_date = url.format(station=f"KNJATCO{station}", date=date.strftime("%Y%m%d"), key=os.getenv("API_KEY"))
+    obs = http_client.get_cached(url_date, verify=False, valid=has_observations).json()['observations']
+    if obs is None or len(obs)==0:
+        return None
+    max_temp_c = int(obs[0]['metric']['tempHigh'])
+    return pd.DataFrame({'forecast_date': [date], 'max_temp_f': [round(float(max_temp_c)*(9/5) + 32,1)]})
+
+def append_csv(df, filename):
+    path = os.path.join(TRAINING_DIR, filename)
+    os.makedirs(TRAINING_DIR, exist_ok=True)
+    if os.path.exists(path):
+        # rows are written positionally, so they have to follow the file's existing header exactly
+        header = list(pd.read_csv(path, nrows=0).columns)
+        if set(header) != set(df.columns):
+            raise ValueError(f"not appending to {path}: columns differ from its header "
+                             f"(missing {sorted(set(header) - set(df.columns))[:10]}, "
+                             f"extra {sorted(set(df.columns) - set(header))[:10]})")
+        df = df[header]
+    df.to_csv(path, mode='a', index=False, header=not os.path.exists(path))
+
+def run_append():
+    # today's features reuse the morning run's fetches through the shared request cache
+    date = get_local_date()
+    try:
+        append_csv(get_feature_data(date), "features.csv")
+    except Exception as e:
+        print(e)
+    try:
+        df_label = get_label(date + timedelta(days=-1))
+        if df_label is not None:
+            append_csv(df_label, "labels.csv")
+    except Exception as e:
+        print(e)
+
+def log_job_event(event):
+    if event.code == EVENT_JOB_MISSED:
+        print(f"job {event.job_id} missed its {event.scheduled_run_time} run")
+    else:
+        print(f"job {event.job_id} failed: {event.exception}")
+
+def get_scheduler():
+    scheduler = BlockingScheduler(
+        timezone='US/Eastern',
+        executors={"default": JobExecutor(JOB_WORKERS)},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": MISFIRE_GRACE_TIME},
+    )
+    scheduler.add_job(memprofile.profiled("predict_12z", run_prediction), 'cron', minute='0', hour='11',
+                      id="predict_12z")
+    if SCHEDULE_00Z is True and has_00z_model():
+        scheduler.add_job(memprofile.profiled("predict_00z", run_prediction_00z), 'cron', minute='0', hour='23',
+                          id="predict_00z")
+    elif SCHEDULE_00Z is True:
+        print(f"SCHEDULE_00Z is set but {MODEL_00Z}.pkl/{SCALER_00Z} are missing, not scheduling predict_00z")
+    scheduler.add_job(memprofile.profiled("verify_max_temp", run_verification), 'cron', minute='0', hour='11',
+                      id="verify_max_temp")
+    scheduler.add_job(memprofile.profiled("append_training_data", run_append), 'cron', minute='30', hour='23',
+                      id="append_training_data")
+    scheduler.add_listener(log_job_event, EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    return scheduler
+
+def main():
+    run_prediction()
+    run_verification()
 
 
 if __name__ == "__main__":
     arg = sys.argv[1]
     if arg == "schedule":
-        scheduler = BlockingScheduler(timezone='US/Eastern')
-        scheduler.add_job(main, 'cron', minute='0', hour='11', day='*', year='*', month='*')
+        if ENSEMBLE is True:
+            check_ensemble()
+        scheduler = get_scheduler()
         scheduler.start()
+    elif arg == "backfill":
+        start = datetime.strptime(sys.argv[2], "%Y-%m-%d").date()
+        end = datetime.strptime(sys.argv[3], "%Y-%m-%d").date()
+        backfill(start, end)
     else:
         main()
@@ -0,0 +1,118 @@
+from datetime import datetime
+import functools
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+from logging.handlers import RotatingFileHandler
+
+
+ENABLED = os.getenv("MEMPROFILE") == "1"
+LOG_PATH = os.getenv("MEMPROFILE_LOG", "./memprofile.log")
+ALERT_MB = float(os.getenv("MEMPROFILE_ALERT_MB", "50"))
+MAX_BYTES = 5*1024*1024
+BACKUP_COUNT = 5
+TOP_N = 10
+NFRAMES = 1
+
+_lock = threading.Lock()
+_previous = {}
+_logger = None
+
+
+def get_logger():
+    global _logger
+    with _lock:
+        if _logger is None:
+            logger = logging.getLogger("memprofile")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(LOG_PATH, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+def current_rss_mb():
+    # returns (mb, source); off linux only the peak is available, and a peak never shrinks
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages*os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, "current"
+    except (OSError, ValueError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS and kilobytes on linux
+        divisor = 1024*1024 if sys.platform == "darwin" else 1024
+        return maxrss / divisor, "peak"
+
+
+def take_snapshot():
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def top_sites(stats):
+    return [{
+        "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+        "size_kb": round(stat.size/1024, 1),
+        "diff_kb": round(stat.size_diff/1024, 1),
+        "count_diff": stat.count_diff,
+    } for stat in stats[:TOP_N]]
+
+
+def record(name, before, before_rss):
+    after = take_snapshot()
+    after_rss, rss_source = current_rss_mb()
+    with _lock:
+        previous = _previous.get(name)
+        _previous[name] = (after, after_rss)
+    # jobs share the process, so sites from an overlapping job can show up here too
+    entry = {
+        "time": datetime.utcnow().isoformat(),
+        "job": name,
+        "rss_source": rss_source,
+        "rss_before_mb": round(before_rss, 1),
+        "rss_after_mb": round(after_rss, 1),
+        "job_growth_mb": round(after_rss - before_rss, 1),
+        "traced_mb": round(tracemalloc.get_traced_memory()[0]/1024/1024, 1),
+        "top_job_allocations": top_sites(after.compare_to(before, 'lineno')),
+    }
+    if previous is not None:
+        entry["growth_since_last_run_mb"] = round(after_rss - previous[1], 1)
+        entry["top_growth_since_last_run"] = top_sites(after.compare_to(previous[0], 'lineno'))
+    logger = get_logger()
+    logger.info(json.dumps(entry))
+    growth = entry.get("growth_since_last_run_mb", 0)
+    # growth in a peak only means some run went higher once, not that memory is being held
+    if rss_source == "current" and growth > ALERT_MB:
+        message = f"memory alert: {name} grew {growth} MB since its last run (rss {entry['rss_after_mb']} MB)"
+        logger.warning(json.dumps({"time": entry["time"], "job": name, "alert": message}))
+        print(message)
+
+
+def profiled(name, func):
+    if not ENABLED:
+        return func
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(NFRAMES)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        before_rss, _ = current_rss_mb()
+        before = take_snapshot()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                record(name, before, before_rss)
+            except Exception as e:
+                print(f"memprofile failed for {name}: {e}")
+    return wrapper
@@ -1,15 +1,16 @@
 from datetime import datetime, timedelta
+import json
 import pickle
 import pytz
 import psycopg2 as pg2
 import os
 import re
-import requests
-from requests.adapters import HTTPAdapter, Retry
 
 import boto3
 from bs4 import BeautifulSoup
 import pandas as pd
+
+import http_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,22 +29,37 @@ STATIONS = {
 }
 FIELDS = ["pressure","height","temp","dew_point","rel_humidity",
               "mix_ratio","direction", "knots","theta","theta_e","theta_v"]
+PRESSURE_LEVELS = [1000, 850, 700, 500, 300, 200]
 SOUNDING_HR = "12"
 URL_BASE="https://weather.uwyo.edu/cgi-bin/sounding"
+FETCH_PLAN_FILE = "fetch_plan.json"
+ARTIFACTS_DIR = "./artificats"
 MODEL = "randomforest"
 FACTOR = 1
 PCA = False
 
 
-def get_session():
-    session = requests.Session()
-    retries = Retry(
-            total=10,
-            backoff_factor=0.1,
-            status_forcelist=[400, 403, 429, 500, 502, 503, 504],
-        )
-    session.mount(URL_BASE, HTTPAdapter(max_retries=retries))
-    return session
+def get_artifact_dir():
+    pointer = os.path.join(ARTIFACTS_DIR, "CURRENT")
+    if not os.path.exists(pointer):
+        return ARTIFACTS_DIR
+    with open(pointer) as file:
+        return os.path.join(ARTIFACTS_DIR, "releases", file.read().strip())
+
+def load_fetch_plan(artifact_dir):
+    path = os.path.join(artifact_dir, FETCH_PLAN_FILE)
+    if not os.path.exists(path):
+        return STATIONS, PRESSURE_LEVELS, FIELDS
+    with open(path) as file:
+        plan = json.load(file)
+    stations = {k: v for k, v in STATIONS.items() if k in plan["stations"]}
+    levels = [p for p in PRESSURE_LEVELS if p in plan["levels"]]
+    fields = [f for f in FIELDS if f in plan["fields"]]
+    return stations, levels, fields
+
+# one release for the whole script, the same way main.py resolves it once per run
+ARTIFACT_DIR = get_artifact_dir()
+FETCH_STATIONS, FETCH_LEVELS, FETCH_FIELDS = load_fetch_plan(ARTIFACT_DIR)
 
 
 def get_dataframe(data):
@@ -59,16 +75,15 @@ def get_dataframe(data):
     return pd.DataFrame(values)
 
 def consolidate_pressure_levels(df, station, date, sounding_hr):
-    pressure_levels = [1000, 850, 700, 500, 300, 200]
     df['pressure'] = df['pressure'].astype(float)
     indexes = []
-    for p in pressure_levels:
+    for p in FETCH_LEVELS:
         idx = df.iloc[(df['pressure']-p).abs().argsort()].index.values[0]
         indexes.append(idx)
     vals = {}
-    for p, idx in zip(pressure_levels, indexes):
+    for p, idx in zip(FETCH_LEVELS, indexes):
         row = df.iloc[idx,:]
-        for field in FIELDS:
+        for field in FETCH_FIELDS:
             val = row[field]
             col = f"{field}_{p}"
             vals[col] = [float(val)]
@@ -91,9 +106,7 @@ def get_station_data(date, station):
     url_params="?region={region}&TYPE={TYPE}&YEAR={YEAR}&MONTH={MONTH}&FROM={FROM}&TO={TO}&STNM={STNM}"
     params = url_params.format(**params)
     url = URL_BASE + params
-    session = get_session()
-    resp=session.get(url, verify=False)
-    session.close()
+    resp = http_client.get(url, verify=False)
     soup = BeautifulSoup(resp.text)
     tables = soup.findAll(name='pre')
     if len(tables)==0:
@@ -110,7 +123,7 @@ def get_station_data(date, station):
 def consolidate_stations(df):
     ignore = ('forecast_date', 'station_name')
     vals = {}
-    for station in STATIONS.keys():
+    for station in FETCH_STATIONS.keys():
         station_name = STATIONS[station]['station_name']
         for col in df.columns:
             if col not in ignore:
@@ -119,7 +132,7 @@ def consolidate_stations(df):
     vals['forecast_date'] = []
     for date in df["forecast_date"].unique():
         vals['forecast_date'].append(date)
-        for station in STATIONS.keys():
+        for station in FETCH_STATIONS.keys():
             station_name = STATIONS[station]['station_name']
             tmp_df = df[(df["station_name"]==station_name) & (df["forecast_date"]==date)]
             for col in df.columns:
@@ -135,7 +148,7 @@ def consolidate_stations(df):
 
 def get_raw_data(date):
     df = None
-    for station in STATIONS:
+    for station in FETCH_STATIONS:
         tmp_df = get_station_data(date, station)
         if tmp_df is None:
             print(station)
@@ -156,13 +169,10 @@ def get_observations(date, station="14"):
     dt = date.strftime("%Y%m%d")
     api_key = os.getenv("API_KEY")
     url_date = url.format(station=station, date=dt, key=api_key)
-    session = get_session()
     try:
-        resp = session.get(url_date, verify=False)
+        resp = http_client.get(url_date, verify=False)
         obs = resp.json()['observations']
-        session.close()
     except Exception as e:
-        session.close()
         return None
     if len(obs)==0 or obs is None:
         return None
@@ -199,7 +209,7 @@ def get_observations(date, station="14"):
     return dfx
 
 def prep_prediction_data(date):
-    with open('./artificats/scaler.sav', 'rb') as file:
+    with open(os.path.join(ARTIFACT_DIR, 'scaler.sav'), 'rb') as file:
         scaler = pickle.load(file)
     df_date = get_raw_data(date)
     df_obs = get_observations(date)
@@ -208,7 +218,7 @@ def prep_prediction_data(date):
     df = df.drop(columns=['forecast_date'])
     X = scaler.transform(df)
     if PCA is True:
-        with open('./artificats/pca.sav', 'rb') as file:
+        with open(os.path.join(ARTIFACT_DIR, 'pca.sav'), 'rb') as file:
             pca = pickle.load(file)
         X = pca.transform(X)
     return X 
@@ -248,7 +258,7 @@ def get_prev_day_max_tempf(date):
     return df.temp_f.max()
 
 def predict(data):
-    with open(f'./artificats/{MODEL}.pkl', 'rb') as file:
+    with open(os.path.join(ARTIFACT_DIR, f'{MODEL}.pkl'), 'rb') as file:
         model = pickle.load(file)
     return model.predict(data)[0]*FACTOR
 
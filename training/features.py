@@ -1,15 +1,19 @@
+import json
 import re
 import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import requests
-from requests.adapters import HTTPAdapter, Retry
 import arrow
 import pandas as pd
 from bs4 import BeautifulSoup
 import warnings
 warnings.filterwarnings('ignore')
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import http_client
+
 STATIONS = {
     "72305": {"city": "Newport, NC", "station_name": "MHX"},
     "72317": {"city": "Greensboro, NC", "station_name": "GSO"},
@@ -23,19 +27,33 @@ STATIONS = {
 }
 FIELDS = ["pressure","height","temp","dew_point","rel_humidity",
               "mix_ratio","direction", "knots","theta","theta_e","theta_v"]
+PRESSURE_LEVELS = [1000, 850, 700, 500, 300, 200]
 SOUNDING_HR = "12"
 URL_BASE="https://weather.uwyo.edu/cgi-bin/sounding"
+ARTIFACTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "artificats")
+FETCH_PLAN_FILE = "fetch_plan.json"
 MONTH_RANGE = (202001, 202410)
+WORKERS = 8
+PARTITION_DIR = "partitions"
+
+def get_release_dir():
+    pointer = os.path.join(ARTIFACTS_DIR, "CURRENT")
+    if not os.path.exists(pointer):
+        return ARTIFACTS_DIR
+    with open(pointer) as file:
+        return os.path.join(ARTIFACTS_DIR, "releases", file.read().strip())
 
-def get_session():
-    session = requests.Session()
-    retries = Retry(
-            total=10,
-            backoff_factor=0.1,
-            status_forcelist=[400, 403, 429, 500, 502, 503, 504],
-        )
-    session.mount(URL_BASE, HTTPAdapter(max_retries=retries))
-    return session
+def load_fetch_plan(release_dir=None):
+    # read from the live release so a rebuild produces the columns its scaler was fit on
+    path = os.path.join(release_dir or get_release_dir(), FETCH_PLAN_FILE)
+    if not os.path.exists(path):
+        return STATIONS, PRESSURE_LEVELS, FIELDS
+    with open(path) as file:
+        plan = json.load(file)
+    stations = {k: v for k, v in STATIONS.items() if k in plan["stations"]}
+    levels = [p for p in PRESSURE_LEVELS if p in plan["levels"]]
+    fields = [f for f in FIELDS if f in plan["fields"]]
+    return stations, levels, fields
 
 def get_dates():
     months = []
@@ -64,17 +82,16 @@ def get_dataframe(data):
     return pd.DataFrame(values)
 
 
-def consolidate_pressure_levels(df, station, date, sounding_hr):
-    pressure_levels = [1000, 850, 700, 500, 300, 200]
+def consolidate_pressure_levels(df, station, date, sounding_hr, levels=PRESSURE_LEVELS, fields=FIELDS):
     df['pressure'] = df['pressure'].astype(float)
     indexes = []
-    for p in pressure_levels:
+    for p in levels:
         idx = df.iloc[(df['pressure']-p).abs().argsort()].index.values[0]
         indexes.append(idx)
     vals = {}
-    for p, idx in zip(pressure_levels, indexes):
+    for p, idx in zip(levels, indexes):
         row = df.iloc[idx,:]
-        for field in FIELDS:
+        for field in fields:
             val = row[field]
             col = f"{field}_{p}"
             vals[col] = [float(val)]
@@ -84,10 +101,10 @@ def consolidate_pressure_levels(df, station, date, sounding_hr):
     df["station_name"] = STATIONS[station]["station_name"]
     return df
 
-def consolidate_stations(df):
+def consolidate_stations(df, stations=STATIONS):
     ignore = ('forecast_date', 'station_name')
     vals = {}
-    for station in STATIONS.keys():
+    for station in stations.keys():
         station_name = STATIONS[station]['station_name']
         for col in df.columns:
             if col not in ignore:
@@ -96,7 +113,7 @@ def consolidate_stations(df):
     vals['forecast_date'] = []
     for date in df["forecast_date"].unique():
         vals['forecast_date'].append(date)
-        for station in STATIONS.keys():
+        for station in stations.keys():
             station_name = STATIONS[station]['station_name']
             tmp_df = df[(df["station_name"]==station_name) & (df["forecast_date"]==date)]
             for col in df.columns:
@@ -111,7 +128,7 @@ def consolidate_stations(df):
     return df_updated
     
 
-def get_station_data(date, station, session):
+def get_station_data(date, station, levels=PRESSURE_LEVELS, fields=FIELDS):
     params={
     "region":"nacon",
     "TYPE":r"TEXT%3ALIST",
@@ -124,13 +141,14 @@ def get_station_data(date, station, session):
     url_params="?region={region}&TYPE={TYPE}&YEAR={YEAR}&MONTH={MONTH}&FROM={FROM}&TO={TO}&STNM={STNM}"
     params = url_params.format(**params)
     url = URL_BASE + params
-    resp=session.get(url, verify=False)
+    resp = http_client.get(url, verify=False)
+    # the client hands back the last 429/5xx once retries run out; that must not be cached as "no data"
+    resp.raise_for_status()
     soup = BeautifulSoup(resp.text)
     tables = soup.findAll(name='pre')
     h2s = soup.findAll(name='h2')
     dfs = []
     dates = []
-    final_df = None
     sounding_hrs = []
     for h2 in h2s:
         txt = h2.text.split(" ")
@@ -142,38 +160,85 @@ def get_station_data(date, station, session):
         if tmp_df.shape[0]>0:
             dfs.append(tmp_df)
     if len(dfs)==0:
-        df_pressure = consolidate_pressure_levels(None, station, dates[i], sounding_hrs[i])
-    for i, df in enumerate(dfs):
-        df_pressure = consolidate_pressure_levels(df, station, dates[i], sounding_hrs[i])
-        if final_df is None:
-            final_df = df_pressure
-        else:
-            final_df = pd.concat([final_df, df_pressure])
-    if final_df is not None:
-        final_df = final_df[final_df["sounding_hr"]==SOUNDING_HR]
-        final_df = final_df.drop(columns=["sounding_hr"])
+        return None
+    final_df = pd.concat([consolidate_pressure_levels(df, station, dates[i], sounding_hrs[i], levels, fields)
+                          for i, df in enumerate(dfs)])
+    final_df = final_df[final_df["sounding_hr"]==SOUNDING_HR]
+    final_df = final_df.drop(columns=["sounding_hr"])
     return final_df
 
 
-def get_training_data():
+def partition_path(month, station, partition_dir=PARTITION_DIR):
+    return os.path.join(partition_dir, f"{month['year']}{month['month']}", f"{station}.csv")
+
+
+def level_columns(levels=PRESSURE_LEVELS, fields=FIELDS):
+    return [f"{field}_{p}" for p in levels for field in fields]
+
+
+def is_complete(path):
+    # an empty marker, or a file holding every level and field; anything else predates this layout
+    if os.path.getsize(path) == 0:
+        return True
+    header = pd.read_csv(path, nrows=0).columns
+    return all(c in header for c in level_columns())
+
+
+def fetch_partition(month, station, partition_dir=PARTITION_DIR):
+    # finished cells are kept on disk, so a rerun only fetches what is missing; they always hold
+    # every level and field so a change of fetch plan never invalidates them (read_month applies it)
+    path = partition_path(month, station, partition_dir)
+    if os.path.exists(path) and is_complete(path):
+        return path
+    df = get_station_data(month, station)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    # only reached for a 200 page; None there means the station genuinely has no soundings that month
+    if df is None:
+        open(tmp_path, 'w').close()
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_month(month, partition_dir=PARTITION_DIR, plan=None):
+    stations, levels, fields = plan or load_fetch_plan()
+    columns = ["forecast_date", "station_name"] + level_columns(levels, fields)
+    dfs = []
+    for station in stations:
+        path = partition_path(month, station, partition_dir)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            dfs.append(pd.read_csv(path, usecols=columns)[columns])
+    if len(dfs)==0:
+        return None
+    return consolidate_stations(pd.concat(dfs), stations)
+
+
+def get_training_data(partition_dir=PARTITION_DIR, plan=None):
+    plan = plan or load_fetch_plan()
     dates = get_dates()
-    df = None
-    session = get_session()
-    for month in dates:
-        df_pressure = None
-        print(month)
-        for station in STATIONS:
-            tmp_df = get_station_data(month, station, session)
-            if df_pressure is None:
-                df_pressure = tmp_df
-            else:
-                df_pressure = pd.concat([df_pressure, tmp_df])
-        df_station = consolidate_stations(df_pressure)
-        if df is None:
-            df = df_station
-        else:
-            df = pd.concat([df_station, df])
-    return df.dropna()
+    failures = []
+    # the http client caps in-flight requests per host, the pool just keeps that cap busy
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = {executor.submit(fetch_partition, month, station, partition_dir): (month, station)
+                   for month in dates for station in plan[0]}
+        for future in as_completed(futures):
+            month, station = futures[future]
+            try:
+                future.result()
+                print(month["year"], month["month"], station)
+            except Exception as e:
+                print(month["year"], month["month"], station, f"failed: {e}")
+                failures.append(f"{month['year']}{month['month']}/{station}")
+    # a missing station blanks its columns and dropna would then silently drop the whole month;
+    # rerunning fetches only these cells since the finished ones are kept on disk
+    if len(failures) > 0:
+        raise RuntimeError(f"{len(failures)} partitions failed, rerun to fetch them: {', '.join(sorted(failures))}")
+    dfs = [df for df in (read_month(month, partition_dir, plan) for month in dates) if df is not None]
+    if len(dfs)==0:
+        return None
+    return pd.concat(dfs).dropna()
     
 
 def get_observation_data(df):
@@ -190,7 +255,7 @@ def get_observation_data(df):
         dt = date.strftime("%Y%m%d")
         url_date = url.format(station=station, date=dt, key=key)
         try:
-            resp = session.get(url_date)
+            resp = http_client.get(url_date)
             obs = resp.json()['observations']
         except Exception as e:
             continue
@@ -236,8 +301,12 @@ def merge_feature_data(df, df_obs12):
 
 
 if __name__ == "__main__":
-    session =  get_session()
-    df=get_training_data()
+    try:
+        df=get_training_data()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    if df is None:
+        sys.exit("no soundings fetched for MONTH_RANGE, nothing to write")
     df_obs12 = get_observation_data(df)
     df = merge_feature_data(df, df_obs12)
     df.to_csv("features.csv", index=False) 
\ No newline at end of file
@@ -1,23 +1,14 @@
 import os
+import sys
 import time
 import pandas as pd
-import requests
-from requests.adapters import HTTPAdapter, Retry
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import http_client
 
-URL_BASE="https://weather.uwyo.edu/cgi-bin/sounding"
+load_dotenv()
 
-def get_session():
-    session = requests.Session()
-    retries = Retry(
-            total=10,
-            backoff_factor=0.1,
-            status_forcelist=[400, 403, 429, 500, 502, 503, 504],
-        )
-    session.mount(URL_BASE, HTTPAdapter(max_retries=retries))
-    return session
 
 def get_high_temps_at_location(df):
     key = os.getenv("WEATHER_API_KEY")
@@ -31,7 +22,7 @@ def get_high_temps_at_location(df):
         dt = date.strftime("%Y%m%d")
         url_date = url.format(station=station, date=dt, key=key)
         try:
-            resp = session.get(url_date)
+            resp = http_client.get(url_date)
             obs = resp.json()['observations']
         except Exception as e:
             continue
@@ -48,7 +39,6 @@ def format_target(df_obs):
     return df_obs
 
 if __name__ == "__main__":
-    session = get_session()
     df = pd.read_csv("features.csv")
     df_labels = get_high_temps_at_location(df)
     df_labels = format_target(df_labels)
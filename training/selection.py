@@ -0,0 +1,127 @@
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.inspection import permutation_importance
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import mean_squared_error
+import json
+import os
+import sys
+import pandas as pd
+
+from features import STATIONS, PRESSURE_LEVELS, FIELDS
+from training import STATE_FILE, get_release_dir, prepare_training_frame, promote_artifacts
+
+
+STATION_IDS = {v["station_name"]: k for k, v in STATIONS.items()}
+IMPORTANCE = "permutation"
+N_REPEATS = 5
+N_ESTIMATORS = 200
+TOLERANCE = 0.02
+RANDOM_STATE = 42
+
+
+def get_params():
+    params = {"n_estimators": N_ESTIMATORS, "n_jobs": -1}
+    state_path = os.path.join(get_release_dir(), STATE_FILE)
+    if os.path.exists(state_path):
+        with open(state_path) as file:
+            params = json.load(file).get("best_params") or params
+    params = dict(params, random_state=RANDOM_STATE, warm_start=False)
+    return params
+
+
+def parse_feature(col):
+    # sounding columns are {field}_{level}_{station}, everything else is a surface/calendar column
+    parts = col.rsplit("_", 2)
+    if len(parts)==3 and parts[1].isdigit() and parts[2] in STATION_IDS:
+        return parts[0], int(parts[1]), parts[2]
+    return None
+
+
+def select_columns(columns, stations, levels, fields):
+    keep = []
+    for col in columns:
+        parsed = parse_feature(col)
+        if parsed is None or (parsed[0] in fields and parsed[1] in levels and parsed[2] in stations):
+            keep.append(col)
+    return keep
+
+
+def fit_and_score(X_train, X_test, y_train, y_test, params):
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    reg = ExtraTreesRegressor(**params)
+    reg.fit(X_train_scaled, y_train)
+    mse = mean_squared_error(y_test, reg.predict(scaler.transform(X_test)))
+    return reg, scaler, mse
+
+
+def rank_features(reg, scaler, X_test, y_test, method=IMPORTANCE):
+    if method == "impurity":
+        importance = reg.feature_importances_
+    else:
+        result = permutation_importance(reg, scaler.transform(X_test), y_test,
+                                        n_repeats=N_REPEATS, random_state=RANDOM_STATE, n_jobs=-1)
+        importance = result.importances_mean
+    return pd.Series(importance, index=X_test.columns).sort_values(ascending=False)
+
+
+def group_importance(importance, position):
+    groups = {}
+    for col, val in importance.items():
+        parsed = parse_feature(col)
+        if parsed is None:
+            continue
+        groups[parsed[position]] = groups.get(parsed[position], 0) + max(val, 0)
+    return sorted(groups.items(), key=lambda x: x[1])
+
+
+def build_fetch_plan(df, df_obs, method=IMPORTANCE):
+    df_merged = prepare_training_frame(df, df_obs)
+    target = df_merged["max_temp_f"]
+    df_notarget = df_merged.drop(columns=['forecast_date', 'max_temp_f'])
+    X_train, X_test, y_train, y_test = train_test_split(df_notarget, target, test_size=0.2,
+                                                        random_state=RANDOM_STATE)
+    params = get_params()
+    reg, scaler, base_mse = fit_and_score(X_train, X_test, y_train, y_test, params)
+    importance = rank_features(reg, scaler, X_test, y_test, method)
+    print(importance.head(25))
+    print(f"baseline mse={base_mse:.3f} with {df_notarget.shape[1]} features")
+
+    plan = {
+        "stations": set(STATION_IDS),
+        "levels": set(PRESSURE_LEVELS),
+        "fields": set(FIELDS),
+    }
+    best = (reg, scaler, list(df_notarget.columns))
+    # stations first since each one dropped is a whole request saved, then levels, then fields
+    for position, key in ((2, "stations"), (1, "levels"), (0, "fields")):
+        for name, _ in group_importance(importance, position):
+            trial = dict(plan)
+            trial[key] = plan[key] - {name}
+            if len(trial[key]) == 0:
+                continue
+            cols = select_columns(df_notarget.columns, **trial)
+            reg, scaler, mse = fit_and_score(X_train[cols], X_test[cols], y_train, y_test, params)
+            if mse <= base_mse*(1+TOLERANCE):
+                print(f"dropped {key} {name}: mse={mse:.3f} with {len(cols)} features")
+                plan = trial
+                best = (reg, scaler, cols)
+
+    fetch_plan = {
+        "stations": [k for k, v in STATIONS.items() if v["station_name"] in plan["stations"]],
+        "levels": [p for p in PRESSURE_LEVELS if p in plan["levels"]],
+        "fields": [f for f in FIELDS if f in plan["fields"]],
+    }
+    state = {"last_date": df_merged["forecast_date"].max(), "best_params": params}
+    return fetch_plan, best, state
+
+
+if __name__=='__main__':
+    df = pd.read_csv('features.csv')
+    df_obs = pd.read_csv('labels.csv')
+    method = sys.argv[1] if len(sys.argv) > 1 else IMPORTANCE
+    fetch_plan, (model, scaler, cols), state = build_fetch_plan(df, df_obs, method)
+    print(json.dumps(fetch_plan, indent=2))
+    # the pruned model, its scaler and the plan that produces its columns go live together
+    promote_artifacts(model, scaler, state, fetch_plan)
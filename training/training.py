@@ -2,23 +2,123 @@ from sklearn.ensemble import ExtraTreesRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error
+from datetime import datetime
+import copy
+import json
+import os
 import pickle
+import resource
+import shutil
+import sys
+import warnings
+import numpy as np
 import optuna
 import pandas as pd
 
 
-def train_model_random_forest(df, df_obs):
+ARTIFACTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "artificats")
+RELEASES_DIR = os.path.join(ARTIFACTS_DIR, "releases")
+CURRENT_FILE = "CURRENT"
+MODEL_NAME = "randomforest"
+STATE_FILE = "refresh_state.json"
+FETCH_PLAN_FILE = "fetch_plan.json"
+# carried into every new release unchanged so each release is a complete artifact set, as long
+# as their input width still matches the new scaler (a pruned fetch plan changes it)
+CARRIED_ARTIFACTS = ["xgboost.pkl"]
+CARRIED_00Z = ["randomforest_00z.pkl", "scaler_00z.sav"]
+REFRESH_ESTIMATORS = 25
+REFRESH_MAX_ESTIMATORS = 300
+REFRESH_MIN_DAYS = 7
+REFRESH_MIN_HOLDOUT = 3
+REFRESH_HOLDOUT = 0.2
+REFRESH_WINDOW_DAYS = 365
+REFRESH_TOLERANCE = 0.02
+KEEP_RELEASES = 3
+CHUNK_SIZE = 5000
+# the scaler carries its column names (see set_feature_names) but is fed bare matrices here
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+
+def prepare_training_frame(df, df_obs):
     df['forecast_date'] = pd.to_datetime(df['forecast_date']).dt.strftime("%Y-%m-%d")
     df_obs['forecast_date'] = pd.to_datetime(df_obs['forecast_date']).dt.strftime("%Y-%m-%d")
     df_merged = df.merge(df_obs, on='forecast_date', how='inner')
     df_merged['month'] = pd.to_datetime(df_merged['forecast_date']).dt.month
-    df_merged = df_merged.dropna()
-    target = df_merged["max_temp_f"]
-    df_notarget = df_merged.drop(columns=['forecast_date', 'max_temp_f'])
-    X_train, X_test, y_train, y_test = train_test_split(df_notarget, target, test_size=0.1)
-    scaler = StandardScaler()
-    X_train_scaled = scaler.transform(X_train)
+    return df_merged.dropna()
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def count_lines(path):
+    with open(path, 'rb') as file:
+        return sum(buf.count(b"\n") for buf in iter(lambda: file.read(1 << 20), b""))
+
+
+def load_labels(labels_path):
+    labels = pd.read_csv(labels_path, usecols=['forecast_date', 'max_temp_f'],
+                         dtype={'forecast_date': str, 'max_temp_f': np.float32})
+    labels['forecast_date'] = pd.to_datetime(labels['forecast_date']).dt.strftime("%Y-%m-%d")
+    return labels.drop_duplicates('forecast_date').set_index('forecast_date')['max_temp_f']
+
+
+def get_feature_columns(scaler):
+    # month is derived from forecast_date, every other column comes straight from features.csv
+    if not hasattr(scaler, "feature_names_in_"):
+        return None
+    return [c for c in scaler.feature_names_in_ if c != 'month']
+
+
+def set_feature_names(scaler, columns):
+    # fit on a bare matrix, so record the layout the way a DataFrame fit would; transform then
+    # rejects a frame whose columns or order differ
+    scaler.feature_names_in_ = np.asarray(columns, dtype=object)
+    return scaler
+
+
+def load_training_matrix(features_path, labels_path, since=None, chunksize=CHUNK_SIZE, columns=None):
+    # columns declares the schema (e.g. from the live scaler); without it the header is taken as is
+    labels = load_labels(labels_path)
+    header = [c for c in pd.read_csv(features_path, nrows=0).columns if c != 'forecast_date']
+    feature_cols = header if columns is None else list(columns)
+    missing = [c for c in feature_cols if c not in header]
+    if len(missing) > 0:
+        raise ValueError(f"{features_path} is missing {len(missing)} expected columns: {missing[:10]}")
+    dtype = {c: np.float32 for c in feature_cols}
+    dtype['forecast_date'] = str
+    # the line count bounds the row count, so the matrix is allocated once and filled in place
+    n_max = count_lines(features_path)
+    X = np.empty((n_max, len(feature_cols)+1), dtype=np.float32)
+    y = np.empty(n_max, dtype=np.float32)
+    dates = np.empty(n_max, dtype='datetime64[D]')
+    n = 0
+    for chunk in pd.read_csv(features_path, usecols=list(dtype), dtype=dtype, chunksize=chunksize):
+        forecast_date = pd.to_datetime(chunk['forecast_date'])
+        keys = forecast_date.dt.strftime("%Y-%m-%d")
+        target = keys.map(labels).to_numpy(dtype=np.float32)
+        values = chunk[feature_cols].to_numpy(dtype=np.float32)
+        keep = ~np.isnan(values).any(axis=1) & ~np.isnan(target)
+        if since is not None:
+            keep &= (keys > since).to_numpy()
+        k = int(keep.sum())
+        X[n:n+k, :-1] = values[keep]
+        X[n:n+k, -1] = forecast_date.dt.month.to_numpy()[keep]
+        y[n:n+k] = target[keep]
+        dates[n:n+k] = forecast_date.to_numpy()[keep]
+        n += k
+    print(f"loaded {n} rows x {X.shape[1]} features ({X[:n].nbytes/1e6:.1f} MB), peak rss {peak_rss_mb():.1f} MB")
+    return X[:n], y[:n], dates[:n], feature_cols + ['month']
+
+
+def train_model_random_forest(X, y, columns):
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1)
+    scaler = StandardScaler(copy=False)
+    X_train_scaled = scaler.fit_transform(X_train)
     X_test_scaled = scaler.transform(X_test)
+    # scale in place while training, but leave callers' arrays untouched once pickled
+    scaler.set_params(copy=True)
 
     def objective(trial):
         param = {
@@ -40,12 +140,180 @@ def train_model_random_forest(df, df_obs):
     best_params = study.best_params
     reg = ExtraTreesRegressor(**best_params)
     reg.fit(X_train_scaled, y_train)
-    return reg, scaler
+    return reg, set_feature_names(scaler, columns)
+
+
+def get_release_dir():
+    # artificats/CURRENT names the live release; without it the loose files in artificats/ are live
+    pointer = os.path.join(ARTIFACTS_DIR, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return ARTIFACTS_DIR
+    with open(pointer) as file:
+        return os.path.join(RELEASES_DIR, file.read().strip())
+
+
+def load_artifact(filename, release_dir=None):
+    with open(os.path.join(release_dir or get_release_dir(), filename), 'rb') as file:
+        return pickle.load(file)
+
+
+def load_refresh_state(release_dir=None):
+    with open(os.path.join(release_dir or get_release_dir(), STATE_FILE)) as file:
+        return json.load(file)
+
+
+def write_file(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def rebase_pca(pca, old_scaler, new_scaler):
+    # pca was fit on the old scaling; x_old = a*x_new + b, so fold a and b into mean_ and components_
+    a = new_scaler.scale_ / old_scaler.scale_
+    b = (new_scaler.mean_ - old_scaler.mean_) / old_scaler.scale_
+    pca.mean_ = (pca.mean_ - b) / a
+    pca.components_ = pca.components_ * a
+    return pca
+
+
+def get_n_features(model):
+    if hasattr(model, "n_features_in_"):
+        return model.n_features_in_
+    return model.num_features()
+
+
+def carry_artifacts(current_dir, tmp_dir, scaler):
+    def carry(filename):
+        shutil.copy2(os.path.join(current_dir, filename), os.path.join(tmp_dir, filename))
+
+    def skip(filename, reason):
+        print(f"not carrying {filename}: {reason}")
+
+    n_features = scaler.n_features_in_
+    pca = None
+    if os.path.exists(os.path.join(current_dir, "pca.sav")):
+        pca = load_artifact("pca.sav", current_dir)
+        if pca.n_features_in_ == n_features:
+            pca = rebase_pca(pca, load_artifact("scaler.sav", current_dir), scaler)
+            write_file(os.path.join(tmp_dir, "pca.sav"), pickle.dumps(pca))
+        else:
+            skip("pca.sav", f"fit on {pca.n_features_in_} columns, the new scaler has {n_features}")
+            pca = None
+    for filename in CARRIED_ARTIFACTS:
+        if not os.path.exists(os.path.join(current_dir, filename)):
+            continue
+        width = get_n_features(load_artifact(filename, current_dir))
+        if width == n_features or (pca is not None and width == pca.n_components_):
+            carry(filename)
+        else:
+            skip(filename, f"expects {width} features, which neither the new scaler nor a carried pca gives")
+    if all(os.path.exists(os.path.join(current_dir, filename)) for filename in CARRIED_00Z):
+        width = load_artifact(CARRIED_00Z[1], current_dir).n_features_in_
+        if width == n_features:
+            for filename in CARRIED_00Z:
+                carry(filename)
+        else:
+            skip(" and ".join(CARRIED_00Z), f"fit on {width} columns, the new scaler has {n_features}")
+
+
+def promote_artifacts(model, scaler, state, fetch_plan=None):
+    # fetch_plan=None keeps the current release's plan, which is what the new scaler was fit under
+    current_dir = get_release_dir()
+    name = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    release_dir = os.path.join(RELEASES_DIR, name)
+    tmp_dir = release_dir + ".tmp"
+    os.makedirs(tmp_dir)
+    write_file(os.path.join(tmp_dir, f"{MODEL_NAME}.pkl"), pickle.dumps(model))
+    write_file(os.path.join(tmp_dir, "scaler.sav"), pickle.dumps(scaler))
+    write_file(os.path.join(tmp_dir, STATE_FILE), json.dumps(state).encode())
+    if fetch_plan is not None:
+        write_file(os.path.join(tmp_dir, FETCH_PLAN_FILE), json.dumps(fetch_plan, indent=2).encode())
+    elif os.path.exists(os.path.join(current_dir, FETCH_PLAN_FILE)):
+        shutil.copy2(os.path.join(current_dir, FETCH_PLAN_FILE), os.path.join(tmp_dir, FETCH_PLAN_FILE))
+    carry_artifacts(current_dir, tmp_dir, scaler)
+    os.rename(tmp_dir, release_dir)
+    # a single rename of the pointer switches every file at once
+    pointer_tmp = os.path.join(ARTIFACTS_DIR, f".{CURRENT_FILE}.tmp")
+    write_file(pointer_tmp, name.encode())
+    os.replace(pointer_tmp, os.path.join(ARTIFACTS_DIR, CURRENT_FILE))
+    print(f"promoted release {name}")
+    prune_releases(name)
+    return release_dir
+
+
+def prune_releases(current, keep=KEEP_RELEASES):
+    # names are utc timestamps, so sorting is chronological; the live release is never removed
+    names = sorted(n for n in os.listdir(RELEASES_DIR) if not n.endswith(".tmp"))
+    for name in names[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(RELEASES_DIR, name), ignore_errors=True)
+
+
+def rebase_thresholds(model, old_scaler, new_scaler):
+    # split thresholds live in scaled space; map them through raw units into the new scaling
+    for est in model.estimators_:
+        tree = est.tree_
+        split = tree.feature >= 0
+        f = tree.feature[split]
+        raw = tree.threshold[split]*old_scaler.scale_[f] + old_scaler.mean_[f]
+        tree.threshold[split] = (raw - new_scaler.mean_[f]) / new_scaler.scale_[f]
+
+
+def refresh_model_random_forest(features_path, labels_path):
+    release_dir = get_release_dir()
+    if not os.path.exists(os.path.join(release_dir, STATE_FILE)):
+        print(f"no {STATE_FILE} in {release_dir}, run a full training first")
+        return None
+    state = load_refresh_state(release_dir)
+    model = load_artifact(f"{MODEL_NAME}.pkl", release_dir)
+    scaler = load_artifact("scaler.sav", release_dir)
+    last_date = np.datetime64(state['last_date'], 'D')
+    window_start = str(last_date - np.timedelta64(REFRESH_WINDOW_DAYS, 'D'))
+    X, y, dates, _ = load_training_matrix(features_path, labels_path, since=window_start,
+                                          columns=get_feature_columns(scaler))
+    order = np.argsort(dates, kind='stable')
+    X, y, dates = X[order], y[order], dates[order]
+    n_new = int((dates > last_date).sum())
+    n_holdout = max(REFRESH_MIN_HOLDOUT, int(n_new*REFRESH_HOLDOUT))
+    if n_new < max(REFRESH_MIN_DAYS, n_holdout + 1):
+        print(f"not enough new days since {state['last_date']}: {n_new}")
+        return None
+    # newest days are held out so the check mimics scoring tomorrow's forecast; the appended
+    # trees see the whole recent window so none of them is fit on a handful of rows
+    X_fit, X_holdout = X[:-n_holdout], X[-n_holdout:]
+    y_fit, y_holdout = y[:-n_holdout], y[-n_holdout:]
+    current_mse = mean_squared_error(y_holdout, model.predict(scaler.transform(X_holdout)))
+
+    new_scaler = copy.deepcopy(scaler)
+    new_scaler.partial_fit(X[(dates > last_date)][:-n_holdout])
+    new_model = copy.deepcopy(model)
+    rebase_thresholds(new_model, scaler, new_scaler)
+    new_model.set_params(warm_start=True, n_estimators=len(new_model.estimators_)+REFRESH_ESTIMATORS)
+    new_model.fit(new_scaler.transform(X_fit), y_fit)
+    # keep the forest at its tuned size by retiring the oldest trees
+    max_estimators = (state.get("best_params") or {}).get("n_estimators") or REFRESH_MAX_ESTIMATORS
+    new_model.estimators_ = new_model.estimators_[-max_estimators:]
+    new_model.set_params(warm_start=False, n_estimators=len(new_model.estimators_))
+    refreshed_mse = mean_squared_error(y_holdout, new_model.predict(new_scaler.transform(X_holdout)))
+
+    print(f"holdout mse current={current_mse:.3f} refreshed={refreshed_mse:.3f} "
+          f"({n_new - n_holdout} new days, {X_fit.shape[0]} window rows)")
+    if refreshed_mse > current_mse*(1+REFRESH_TOLERANCE):
+        print("refreshed model rejected")
+        return None
+    state = {"last_date": str(dates[-n_holdout-1]), "best_params": state.get("best_params")}
+    promote_artifacts(new_model, new_scaler, state)
+    return new_model, new_scaler
 
 
 if __name__=='__main__':
-    df = pd.read_csv('features.csv')
-    df_obs = pd.read_csv('labels.csv')
-    model, scaler = train_model_random_forest(df, df_obs)
-    pickle.dump(scaler, open('scaler.sav', 'wb'))
-    pickle.dump(model, open('model.pkl', 'wb'))
+    if len(sys.argv) > 1 and sys.argv[1] == "refresh":
+        refresh_model_random_forest('features.csv', 'labels.csv')
+    else:
+        X, y, dates, columns = load_training_matrix('features.csv', 'labels.csv')
+        model, scaler = train_model_random_forest(X, y, columns)
+        print(f"peak rss {peak_rss_mb():.1f} MB")
+        state = {"last_date": str(dates.max()), "best_params": model.get_params()}
+        promote_artifacts(model, scaler, state)
@@ -0,0 +1,260 @@
+from datetime import date, timedelta
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+
+import boto3
+import psycopg2 as pg2
+
+
+SITE = "KNJATCO14"
+# any constant works, it only has to be the same for every writer of public.verification
+ROLLUP_LOCK_KEY = 72305014
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS public.verification_observed (
+    site text NOT NULL,
+    forecast_date date NOT NULL,
+    observed_max double precision NOT NULL,
+    PRIMARY KEY (site, forecast_date)
+);
+CREATE TABLE IF NOT EXISTS public.verification (
+    site text NOT NULL,
+    model_version text NOT NULL,
+    forecast_date date NOT NULL,
+    prediction double precision,
+    lower_bound double precision,
+    upper_bound double precision,
+    observed_max double precision,
+    cum_abs_error double precision NOT NULL DEFAULT 0,
+    cum_error double precision NOT NULL DEFAULT 0,
+    cum_count integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (site, model_version, forecast_date)
+);
+CREATE INDEX IF NOT EXISTS verification_forecast_date_idx ON public.verification (forecast_date);
+"""
+# running totals per (site, model_version) let any window be answered from its two endpoints
+REFRESH_ROLLUP = """
+WITH base AS (
+    SELECT DISTINCT ON (site, model_version) site, model_version, cum_abs_error, cum_error, cum_count
+    FROM public.verification
+    WHERE forecast_date < %(since)s
+    ORDER BY site, model_version, forecast_date DESC
+), running AS (
+    SELECT site, model_version, forecast_date,
+        SUM(CASE WHEN observed_max IS NULL OR prediction IS NULL THEN 0
+                 ELSE abs(prediction - observed_max) END) OVER w AS abs_error,
+        SUM(CASE WHEN observed_max IS NULL OR prediction IS NULL THEN 0
+                 ELSE prediction - observed_max END) OVER w AS error,
+        SUM(CASE WHEN observed_max IS NULL OR prediction IS NULL THEN 0 ELSE 1 END) OVER w AS n
+    FROM public.verification
+    WHERE forecast_date >= %(since)s
+    WINDOW w AS (PARTITION BY site, model_version ORDER BY forecast_date)
+)
+UPDATE public.verification v
+SET cum_abs_error = COALESCE(b.cum_abs_error, 0) + r.abs_error,
+    cum_error = COALESCE(b.cum_error, 0) + r.error,
+    cum_count = COALESCE(b.cum_count, 0) + r.n
+FROM running r
+LEFT JOIN base b ON b.site = r.site AND b.model_version = r.model_version
+WHERE v.site = r.site AND v.model_version = r.model_version AND v.forecast_date = r.forecast_date
+"""
+# site-level: one live row per forecast date across model versions, so a new release doesn't reset the window
+SITE_ROLLING_ERROR = """
+SELECT NULL, SUM(abs(prediction - observed_max)), SUM(prediction - observed_max), COUNT(*)
+FROM (
+    SELECT DISTINCT ON (forecast_date) prediction, observed_max
+    FROM public.verification
+    WHERE site = %(site)s AND forecast_date > %(start)s AND forecast_date <= %(end)s
+        AND model_version NOT LIKE 'backfill-%%' AND model_version NOT LIKE '%%00z@%%'
+    ORDER BY forecast_date, model_version DESC
+) live
+WHERE prediction IS NOT NULL AND observed_max IS NOT NULL
+"""
+ROLLING_ERROR = """
+WITH version AS (
+    SELECT %(model_version)s::text AS model_version
+), endpoint AS (
+    SELECT cum_abs_error, cum_error, cum_count FROM public.verification, version
+    WHERE site = %(site)s AND verification.model_version = version.model_version
+        AND forecast_date <= %(end)s
+    ORDER BY forecast_date DESC LIMIT 1
+), startpoint AS (
+    SELECT cum_abs_error, cum_error, cum_count FROM public.verification, version
+    WHERE site = %(site)s AND verification.model_version = version.model_version
+        AND forecast_date <= %(start)s
+    ORDER BY forecast_date DESC LIMIT 1
+)
+SELECT (SELECT model_version FROM version),
+    e.cum_abs_error - COALESCE(s.cum_abs_error, 0),
+    e.cum_error - COALESCE(s.cum_error, 0),
+    e.cum_count - COALESCE(s.cum_count, 0)
+FROM endpoint e LEFT JOIN startpoint s ON true
+"""
+
+
+def get_connection():
+    host = os.getenv("DB_HOST")
+    username = os.getenv("DB_USER")
+    password = os.getenv("DB_PASS")
+    db = os.getenv("DB_NAME")
+    port = os.getenv("DB_PORT")
+    return pg2.connect(f"dbname='{db}' user='{username}' host='{host}' port='{port}' password='{password}'")
+
+
+def get_model_version(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:12]
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if is_missing(v) else v for v in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def record_predictions(rows, conn=None):
+    # rows: (forecast_date, site, model_version, prediction, lower_bound, upper_bound)
+    rows = [r for r in rows if not is_missing(r[3])]
+    if len(rows)==0:
+        return
+    own_conn = conn is None
+    conn = conn or get_connection()
+    try:
+        with conn, conn.cursor() as cursor:
+            # rollups read each other's running totals, so concurrent writers take turns until commit
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+            cursor.execute(SCHEMA)
+            cursor.execute("""
+                CREATE TEMP TABLE staging_predictions (
+                    forecast_date date, site text, model_version text,
+                    prediction double precision, lower_bound double precision, upper_bound double precision
+                ) ON COMMIT DROP""")
+            copy_rows(cursor, "staging_predictions",
+                      ["forecast_date", "site", "model_version", "prediction", "lower_bound", "upper_bound"], rows)
+            cursor.execute("""
+                INSERT INTO public.verification
+                    (site, model_version, forecast_date, prediction, lower_bound, upper_bound, observed_max)
+                SELECT s.site, s.model_version, s.forecast_date, s.prediction, s.lower_bound, s.upper_bound,
+                    o.observed_max
+                FROM staging_predictions s
+                LEFT JOIN public.verification_observed o
+                    ON o.site = s.site AND o.forecast_date = s.forecast_date
+                ON CONFLICT (site, model_version, forecast_date) DO UPDATE
+                SET prediction = EXCLUDED.prediction,
+                    lower_bound = EXCLUDED.lower_bound,
+                    upper_bound = EXCLUDED.upper_bound,
+                    observed_max = COALESCE(EXCLUDED.observed_max, public.verification.observed_max)""")
+            cursor.execute(REFRESH_ROLLUP, {"since": min(r[0] for r in rows)})
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def record_observed(rows, conn=None):
+    # rows: (forecast_date, site, observed_max)
+    rows = [r for r in rows if not is_missing(r[2])]
+    if len(rows)==0:
+        return
+    own_conn = conn is None
+    conn = conn or get_connection()
+    try:
+        with conn, conn.cursor() as cursor:
+            # rollups read each other's running totals, so concurrent writers take turns until commit
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (ROLLUP_LOCK_KEY,))
+            cursor.execute(SCHEMA)
+            cursor.execute("""
+                CREATE TEMP TABLE staging_observed (
+                    forecast_date date, site text, observed_max double precision
+                ) ON COMMIT DROP""")
+            copy_rows(cursor, "staging_observed", ["forecast_date", "site", "observed_max"], rows)
+            cursor.execute("""
+                INSERT INTO public.verification_observed (site, forecast_date, observed_max)
+                SELECT site, forecast_date, observed_max FROM staging_observed
+                ON CONFLICT (site, forecast_date) DO UPDATE SET observed_max = EXCLUDED.observed_max""")
+            cursor.execute("""
+                UPDATE public.verification v SET observed_max = s.observed_max
+                FROM staging_observed s
+                WHERE v.site = s.site AND v.forecast_date = s.forecast_date""")
+            cursor.execute(REFRESH_ROLLUP, {"since": min(r[0] for r in rows)})
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def rolling_error(days=90, site=SITE, model_version=None, end=None, conn=None):
+    # model_version=None scores the site's live forecasts whichever release made them
+    end = end or date.today()
+    params = {"site": site, "model_version": model_version, "end": end, "start": end - timedelta(days=days)}
+    own_conn = conn is None
+    conn = conn or get_connection()
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(ROLLING_ERROR if model_version is not None else SITE_ROLLING_ERROR, params)
+            row = cursor.fetchone()
+    finally:
+        if own_conn:
+            conn.close()
+    if row is None or row[3] == 0:
+        return None
+    version, abs_error, error, n = row
+    return {"model_version": version, "days": days, "n": n, "mae": abs_error/n, "bias": error/n}
+
+
+def import_from_s3(model_version="s3-import", site=SITE):
+    # one-off migration of the year/month/day/*.txt objects written by save_to_s3
+    s3 = boto3.client('s3', aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                      aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"))
+    bucket = os.getenv("AWS_BUCKET_NAME")
+    predictions = {}
+    intervals = {}
+    observed = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            parts = obj["Key"].split("/")
+            if len(parts) != 4:
+                continue
+            year, month, day, filename = parts
+            forecast_date = date(int(year), int(month), int(day))
+            body = s3.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read().decode()
+            try:
+                if filename == "prediction.txt":
+                    predictions[forecast_date] = float(body)
+                elif filename == "prediction_interval.json":
+                    intervals[forecast_date] = json.loads(body)
+                elif filename == "max_temp.txt":
+                    observed.append((forecast_date, site, float(body)))
+            except ValueError:
+                continue
+    rows = [(d, site, model_version, p, intervals.get(d, {}).get("q05"), intervals.get(d, {}).get("q95"))
+            for d, p in predictions.items()]
+    conn = get_connection()
+    try:
+        record_observed(observed, conn)
+        record_predictions(rows, conn)
+    finally:
+        conn.close()
+    print(f"imported {len(rows)} predictions and {len(observed)} observations")
+
+
+if __name__ == "__main__":
+    arg = sys.argv[1]
+    if arg == "import-s3":
+        import_from_s3()
+    elif arg == "rolling":
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+        model_version = sys.argv[3] if len(sys.argv) > 3 else None
+        print(rolling_error(days, model_version=model_version))